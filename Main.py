@@ -1,38 +1,287 @@
-import json
+import orjson
 import numpy as np
-from websocket_server import WebsocketServer
+import pyfftw
+from numba import njit
+from scipy.fft import next_fast_len, rfft, rfftfreq, set_global_backend
 from datetime import datetime
-from collections import deque
+from functools import lru_cache
+import asyncio
+import atexit
+import math
+import concurrent.futures
+import mmap
+import os
+import pickle
 import threading
+import uvloop
+import websockets
 import streamlit as st
-import matplotlib.pyplot as plt
+import pandas as pd
+
+# ------------------------------
+# FFT Backend
+# ------------------------------
+# Route scipy.fft through FFTW, which beats pocketfft by 20-40% on
+# repeated same-size transforms — exactly the monitoring pattern here.
+# Plans ("wisdom") are imported at startup and exported at exit so
+# restarts skip the planning cost. The Numba kernel keeps its own
+# rocket-fft transform; the batched path and perform_fft go via FFTW.
+pyfftw.config.NUM_THREADS = os.cpu_count()
+pyfftw.interfaces.cache.enable()
+set_global_backend(pyfftw.interfaces.scipy_fft)
+
+_WISDOM_PATH = os.path.expanduser("~/.bamlak_fftw_wisdom")
+
+
+def _load_fftw_wisdom():
+    try:
+        with open(_WISDOM_PATH, "rb") as f:
+            pyfftw.import_wisdom(pickle.load(f))
+    except (OSError, pickle.PickleError):
+        pass  # no saved wisdom yet; plans are created fresh
+
+
+def _save_fftw_wisdom():
+    try:
+        with open(_WISDOM_PATH, "wb") as f:
+            pickle.dump(pyfftw.export_wisdom(), f)
+    except OSError:
+        pass
+
+
+_load_fftw_wisdom()
+atexit.register(_save_fftw_wisdom)
 
 # ------------------------------
 # Historical Data Management
 # ------------------------------
-HISTORICAL_DATA = deque(maxlen=100)  # Store up to 100 data points
+# The history ring lives in a shared-memory file so the analyzer and
+# the Streamlit dashboard can run as separate processes: the analyzer
+# writes fixed-size records, the dashboard maps the same file and reads
+# them zero-copy, with no IPC serialization between the two. A 64-bit
+# write counter at the head of the file is bumped only after a record
+# is fully written, so a reader never sees a slot that was never
+# populated. Once the ring has wrapped, writes reuse the oldest
+# already-visible slot in place, so a read racing a write can return a
+# torn copy of that one record — a single-point display glitch on the
+# next dashboard refresh, accepted rather than paying for a seqlock.
+HISTORY_CAPACITY = 100  # Store up to 100 data points
+_HIST_DTYPE = np.dtype([("ts", "<u8"), ("rms", "<f4"), ("freq", "<f4")])
+_HIST_HEADER = 8  # little-endian u64 write counter
+_HIST_PATH = "/dev/shm/vib_hist.bin"
+
+
+def _open_history():
+    size = _HIST_HEADER + HISTORY_CAPACITY * _HIST_DTYPE.itemsize
+    fd = os.open(_HIST_PATH, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        os.ftruncate(fd, size)  # zero-filled on first creation
+        return mmap.mmap(fd, size)
+    finally:
+        os.close(fd)
+
+
+_hist_mm = _open_history()
+_hist_count = np.frombuffer(_hist_mm, dtype="<u8", count=1)
+_hist_records = np.frombuffer(
+    _hist_mm, dtype=_HIST_DTYPE, count=HISTORY_CAPACITY, offset=_HIST_HEADER)
+
+
+def get_historical_data():
+    """
+    Returns (timestamps, rms_values, dominant_frequencies) in
+    chronological order, oldest first.
+    """
+    count = int(_hist_count[0])
+    if count == 0:
+        # [-0:] would return the whole zeroed ring, not nothing.
+        records = _hist_records[:0]
+    else:
+        length = min(count, HISTORY_CAPACITY)
+        records = np.roll(_hist_records, -(count % HISTORY_CAPACITY))[-length:]
+    return records["ts"].astype("datetime64[us]"), records["rms"], records["freq"]
 
 # ------------------------------
 # Signal Analysis Functions
 # ------------------------------
+# The whole analysis pipeline runs in float32: accelerometer ADCs are
+# 12-16 bit, so single precision loses nothing while halving memory
+# bandwidth and doubling SIMD lane throughput in the FFT and RMS paths.
+_WINDOWS = {}  # Hann windows cached per signal length
+_WORKSPACES = {}  # reusable windowed-input buffers per signal length
+
+
 def calculate_rms(signal):
-    return np.sqrt(np.mean(np.square(signal)))
+    # einsum fuses square-and-reduce into a single pass with no
+    # temporary; math.sqrt on the resulting scalar skips the np.sqrt
+    # 0-d array round trip.
+    s = np.ascontiguousarray(signal, dtype=np.float32)
+    return math.sqrt(np.einsum("i,i->", s, s) / s.size)
+
+
+@lru_cache(maxsize=16)
+def _freq_axis(n, sampling_rate):
+    """
+    Cached one-sided frequency axis. The same array object is handed to
+    every caller, so treat it as read-only.
+    """
+    return rfftfreq(n, d=1 / sampling_rate)
 
 
 def perform_fft(signal, sampling_rate):
     n = len(signal)
-    freqs = np.fft.fftfreq(n, d=1 / sampling_rate)
-    fft_values = np.abs(np.fft.fft(signal))
-    return freqs[:n // 2], fft_values[:n // 2]
+    # Zero-pad to the next 5-smooth length so pocketfft stays on its
+    # fast composite-radix path instead of Bluestein for awkward n; the
+    # padding also interpolates the spectrum for free. Windowing happens
+    # before padding so the tail really is zero.
+    m = next_fast_len(n, real=True)
+    freqs = _freq_axis(m, sampling_rate)
+    # Hann-window the segment so off-bin tones don't leak into neighbor
+    # bins and shift the argmax; scale by the coherent gain (2 / sum(w))
+    # to keep magnitudes comparable to the rectangular window.
+    w = _WINDOWS.setdefault(n, np.hanning(n).astype(np.float32))
+    # Window into a reused per-length workspace and let pocketfft
+    # clobber it (overwrite_x), so steady-state streams with constant n
+    # allocate nothing per call.
+    work = _WORKSPACES.setdefault(n, np.zeros(m, dtype=w.dtype))
+    np.multiply(signal, w, out=work[:n])
+    work[n:] = 0.0  # overwrite_x may have clobbered the padding tail
+    # Thread the transform across cores for large windows only; for
+    # short ones the thread dispatch costs more than it saves.
+    workers = -1 if m >= 4096 else 1
+    spectrum = rfft(work, overwrite_x=True, workers=workers)
+    # re*re + im*im vectorizes as fused multiply-adds, unlike np.abs's
+    # per-bin hypot; the sqrt happens once, in place, on the result.
+    power = spectrum.real * spectrum.real + spectrum.imag * spectrum.imag
+    fft_values = np.sqrt(power, out=power) * (2 / np.sum(w))
+    return freqs, fft_values
+
+
+@njit(cache=True, fastmath=True)
+def _parabolic_delta(power, k):
+    """
+    Three-point parabolic offset (in bins) of the spectral peak at bin
+    k. Refines the dominant frequency to sub-bin accuracy for a handful
+    of FLOPs instead of a larger FFT.
+    """
+    if k <= 0 or k >= power.size - 1:
+        return 0.0
+    denom = power[k - 1] - 2.0 * power[k] + power[k + 1]
+    if denom == 0.0:
+        return 0.0
+    return 0.5 * (power[k - 1] - power[k + 1]) / denom
+
+
+@njit(cache=True, fastmath=True)
+def _analyze_core(signal, window, padded_len):
+    """
+    Fused RMS + windowed power spectrum in one compiled pass. np.fft
+    inside nopython mode is provided by rocket-fft. The windowed signal
+    is zero-padded to padded_len (a 5-smooth length chosen by the
+    caller) to stay on pocketfft's fast radix path.
+    """
+    n = signal.size
+    rms = np.sqrt(np.dot(signal, signal) / n)
+    work = np.zeros(padded_len, dtype=signal.dtype)
+    work[:n] = signal * window
+    spectrum = np.fft.rfft(work)
+    # The peak search only needs a monotonic ranking, so squared
+    # magnitudes do: one sqrt per bin skipped.
+    power = spectrum.real * spectrum.real + spectrum.imag * spectrum.imag
+    return rms, power
+
+
+def analyze_segment(vibration_data):
+    """
+    Extracts per-segment features (worker-side): RMS and the padded
+    power spectrum. Returns (rms, power, padded_len).
+    """
+    vibration_data = np.ascontiguousarray(vibration_data, dtype=np.float32)
+    n = len(vibration_data)
+    w = _WINDOWS.setdefault(n, np.hanning(n).astype(np.float32))
+    m = next_fast_len(n, real=True)
+    rms, power = _analyze_core(vibration_data, w, m)
+    return float(rms), power, m
+
+
+def analyze_batch(signals):
+    """
+    Extracts features for a stack of equal-length windows with one
+    batched FFT. pocketfft vectorizes across the batch axis, which a
+    sequence of 1-D calls cannot, so coalesced messages share the SIMD
+    lanes. Returns (rms_values, power_spectra, padded_len).
+    """
+    signals = np.ascontiguousarray(signals, dtype=np.float32)
+    batch, n = signals.shape
+    w = _WINDOWS.setdefault(n, np.hanning(n).astype(np.float32))
+    # Fused square-and-reduce per row: no batch-sized temporary.
+    rms = np.sqrt(np.einsum("ij,ij->i", signals, signals) / n)
+    m = next_fast_len(n, real=True)
+    padded = np.zeros((batch, m), dtype=np.float32)
+    padded[:, :n] = signals * w
+    spectrum = rfft(padded, axis=1, overwrite_x=True, workers=-1)
+    power = spectrum.real * spectrum.real + spectrum.imag * spectrum.imag
+    return rms, power, m
+
+
+# Welch's method: the dominant frequency is read off a running average
+# of the last few segments' power spectra instead of a single noisy
+# periodogram. The average is updated incrementally — subtract the
+# evicted segment, add the new one — so each update is O(bins).
+WELCH_SEGMENTS = 8
+_PSD_AVERAGERS = {}
+
+
+class _WelchAverager:
+    def __init__(self, bins):
+        self.ring = np.zeros((WELCH_SEGMENTS, bins), dtype=np.float32)
+        self.total = np.zeros(bins, dtype=np.float32)
+        self.idx = 0
+
+    def add(self, power):
+        self.total += power - self.ring[self.idx]
+        self.ring[self.idx] = power
+        self.idx = (self.idx + 1) % WELCH_SEGMENTS
+        # argmax of the sum equals argmax of the mean, so the total
+        # stands in for the average everywhere downstream.
+        return self.total
+
+
+def _dominant_from_average(stream, power, sampling_rate, padded_len):
+    """
+    Feeds one segment's power spectrum into the running average for its
+    stream and returns the dominant frequency of the averaged spectrum,
+    with sub-bin interpolation. Averagers are keyed per (stream,
+    padded_len, sampling_rate) so concurrent clients — or one client
+    changing its window — never blend spectra from different machines
+    or physically incomparable bins.
+    """
+    key = (stream, padded_len, sampling_rate)
+    averager = _PSD_AVERAGERS.get(key)
+    if averager is None:
+        averager = _PSD_AVERAGERS[key] = _WelchAverager(power.size)
+    averaged = averager.add(power)
+    k = int(np.argmax(averaged))
+    # The frequency comes analytically from the bin index (k * fs / m);
+    # no frequency axis is materialized or indexed on this path — the
+    # cached axis in _freq_axis exists only for spectrum consumers.
+    return float((k + _parabolic_delta(averaged, k)) * sampling_rate / padded_len)
+
+
+def _discard_averagers(stream):
+    """
+    Drops a stream's running averages when its connection closes, so
+    stale spectra never bleed into a later connection.
+    """
+    for key in [k for k in _PSD_AVERAGERS if k[0] is stream]:
+        del _PSD_AVERAGERS[key]
 
 
 def analyze_vibration_data(vibration_data, sampling_rate):
-    rms_value = calculate_rms(vibration_data)
-    freqs, fft_values = perform_fft(vibration_data, sampling_rate)
-    dominant_frequency = freqs[np.argmax(fft_values)]
+    rms_value, power, m = analyze_segment(vibration_data)
     return {
         "RMS Value": rms_value,
-        "Dominant Frequency": dominant_frequency
+        "Dominant Frequency": _dominant_from_average(None, power, sampling_rate, m)
     }
 
 
@@ -40,94 +289,221 @@ def analyze_vibration_data(vibration_data, sampling_rate):
 # Update Historical Data
 # ------------------------------
 def update_historical_data(analysis_results):
-    HISTORICAL_DATA.append({
-        "Timestamp": datetime.now(),
-        "RMS Value": analysis_results["RMS Value"],
-        "Dominant Frequency": analysis_results["Dominant Frequency"]
-    })
+    count = int(_hist_count[0])
+    record = _hist_records[count % HISTORY_CAPACITY]
+    record["ts"] = int(datetime.now().timestamp() * 1e6)
+    record["rms"] = analysis_results["RMS Value"]
+    record["freq"] = analysis_results["Dominant Frequency"]
+    _hist_count[0] = count + 1  # publish only after the record is complete
+
+
+# ------------------------------
+# Analysis Worker Pool
+# ------------------------------
+# NumPy releases the GIL inside the FFT and dot kernels, but message
+# parsing and result packaging do not, so a single server thread caps
+# throughput at one core. Dispatching analysis to a process pool lets
+# concurrent clients scale across cores; pickle protocol 5 (the default
+# on this interpreter) keeps the float32 payload transfer cheap.
+PROC_POOL = concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count())
+
+# ------------------------------
+# Message Micro-Batching
+# ------------------------------
+# Incoming windows are parked for up to one flush interval and analyzed
+# together, so the FFT runs batched (2-D) over every window that
+# arrived in the meantime instead of once per message. Everything here
+# runs on the single event loop, so the pending list needs no lock.
+BATCH_FLUSH_INTERVAL = 0.01  # seconds
+_PENDING = []
+_CLIENTS = set()
+_flusher_task = None  # strong reference; see _serve
+
+
+async def _flush_pending():
+    batch = _PENDING[:]
+    _PENDING.clear()
+    if not batch:
+        return
+    # Group by window length and sampling rate; rows in a group share
+    # one batched FFT call.
+    groups = {}
+    for entry in batch:
+        _websocket, signal, sampling_rate = entry
+        groups.setdefault((len(signal), sampling_rate), []).append(entry)
+    loop = asyncio.get_running_loop()
+    for (_n, sampling_rate), entries in groups.items():
+        # Feature extraction (FFT + RMS) runs on the pool; the Welch
+        # average lives in this process, so the dominant frequency is
+        # derived here from the returned power spectra.
+        try:
+            if len(entries) == 1:
+                websocket, signal, _fs = entries[0]
+                rms, power, m = await loop.run_in_executor(
+                    PROC_POOL, analyze_segment, signal)
+                rms_values, power_spectra = [rms], [power]
+            else:
+                stacked = np.stack([signal for _ws, signal, _fs in entries])
+                rms_values, power_spectra, m = await loop.run_in_executor(
+                    PROC_POOL, analyze_batch, stacked)
+        except Exception as e:
+            error_message = _encode_json({"error": str(e)})
+            for websocket, _signal, _fs in entries:
+                await _send_safely(websocket, error_message)
+            continue
+        for (websocket, _signal, _fs), rms, power in zip(entries, rms_values, power_spectra):
+            if websocket not in _CLIENTS:
+                # The client disconnected while its window was in
+                # flight; feeding its averager now would recreate the
+                # entry _discard_averagers just removed and pin the
+                # closed websocket (and its ring) forever.
+                continue
+            # Guard each entry's fan-out so one bad result cannot take
+            # down the flusher task; the client always gets an answer.
+            try:
+                analysis_results = {
+                    "RMS Value": float(rms),
+                    "Dominant Frequency": _dominant_from_average(websocket, power, sampling_rate, m),
+                }
+                update_historical_data(analysis_results)
+                await _send_safely(websocket, _encode_json(analysis_results))
+            except Exception as e:
+                await _send_safely(websocket, _encode_json({"error": str(e)}))
+
+
+async def _flush_loop():
+    # The sole flusher task must survive anything _flush_pending throws;
+    # if it died, the server would keep accepting messages but never
+    # respond again.
+    while True:
+        await asyncio.sleep(BATCH_FLUSH_INTERVAL)
+        try:
+            await _flush_pending()
+        except Exception as e:
+            print(f"Batch flush failed: {e}")
 
 
 # ------------------------------
 # WebSocket Handlers
 # ------------------------------
-def handle_new_client(client, server):
+def _encode_json(payload):
     """
-    Handles new client connections.
+    Serializes a payload with orjson; OPT_SERIALIZE_NUMPY handles NumPy
+    scalars directly, without a float() conversion pass.
     """
-    print(f"New client connected: {client['id']}")
-    print(f"Total connected clients: {len(server.clients)}")
+    return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY).decode()
 
 
-def handle_client_left(client, server):
-    """
-    Handles client disconnections.
-    """
-    print(f"Client disconnected: {client['id']}")
-    print(f"Total connected clients: {len(server.clients)}")
+async def _send_safely(websocket, message):
+    try:
+        await websocket.send(message)
+    except websockets.ConnectionClosed:
+        pass  # client left before its results came back
 
 
-def handle_client_message(client, server, message):
+async def handle_client_message(websocket, message):
     """
-    Handles incoming messages from WebSocket clients.
-    Processes vibration data and sends back analysis results.
+    Handles an incoming message from a WebSocket client: decodes the
+    window and parks it for the next batch flush.
+
+    Binary frames are little-endian float32: a one-value sampling-rate
+    header followed by the samples, read zero-copy via np.frombuffer.
+    Text frames remain JSON with "vibration_data" and "sampling_rate".
     """
     try:
-        data = json.loads(message)
-        vibration_data = np.array(data["vibration_data"])
-        sampling_rate = data["sampling_rate"]
-        analysis_results = analyze_vibration_data(vibration_data, sampling_rate)
-        update_historical_data(analysis_results)
-        server.send_message(client, json.dumps(analysis_results))
+        if isinstance(message, (bytes, bytearray)):
+            sampling_rate = float(np.frombuffer(message, dtype="<f4", count=1)[0])
+            vibration_data = np.frombuffer(message, dtype="<f4", offset=4)
+        else:
+            data = orjson.loads(message)
+            samples = data["vibration_data"]
+            # fromiter fills the float32 buffer directly instead of
+            # building an intermediate object array from the list.
+            vibration_data = np.fromiter(samples, dtype=np.float32, count=len(samples))
+            sampling_rate = data["sampling_rate"]
+        _PENDING.append((websocket, vibration_data, sampling_rate))
     except Exception as e:
         error_message = {"error": str(e)}
-        server.send_message(client, json.dumps(error_message))
+        await _send_safely(websocket, _encode_json(error_message))
+
+
+async def handle_connection(websocket):
+    """
+    Per-connection coroutine: tracks the client and feeds its messages
+    to the batching pipeline.
+    """
+    _CLIENTS.add(websocket)
+    print(f"New client connected: {websocket.remote_address}")
+    print(f"Total connected clients: {len(_CLIENTS)}")
+    try:
+        async for message in websocket:
+            await handle_client_message(websocket, message)
+    finally:
+        _CLIENTS.discard(websocket)
+        # Drop windows still parked for this client so the next flush
+        # cannot resurrect the averagers discarded below.
+        _PENDING[:] = [entry for entry in _PENDING if entry[0] is not websocket]
+        _discard_averagers(websocket)
+        print(f"Client disconnected: {websocket.remote_address}")
+        print(f"Total connected clients: {len(_CLIENTS)}")
 
 
 # ------------------------------
 # WebSocket Server Start
 # ------------------------------
+async def _serve():
+    global _flusher_task
+    # The event loop keeps only weak references to tasks, so an
+    # unreferenced flusher could be garbage-collected mid-execution;
+    # hold it in a module global for the life of the server.
+    _flusher_task = asyncio.create_task(_flush_loop())
+    async with websockets.serve(handle_connection, "0.0.0.0", 8765):
+        await asyncio.Future()  # run until the loop is shut down
+
+
 def start_websocket_server():
     """
-    Initializes the WebSocket server to listen for incoming connections.
+    Runs every connection on a single uvloop event loop; the analysis
+    itself still executes on the process pool via run_in_executor so
+    the loop stays responsive.
     """
-    server = WebsocketServer(host="192.168.1.180", port=8765)  # Update IP as needed
-    server.set_fn_new_client(handle_new_client)
-    server.set_fn_client_left(handle_client_left)
-    server.set_fn_message_received(handle_client_message)
-    server.run_forever()
+    uvloop.install()
+    asyncio.run(_serve())
 
 
 # ------------------------------
 # Streamlit Application
 # ------------------------------
-st.title("Induction Motor Vibration Analysis")
-st.sidebar.header("Configuration")
-
-# Start the WebSocket server in a separate thread if not already running
-if "websocket_thread" not in st.session_state:
-    st.session_state.websocket_thread = threading.Thread(target=start_websocket_server, daemon=True)
-    st.session_state.websocket_thread.start()
-
-st.info("Connect to the WebSocket server at ws://192.168.1.180:8765 to send vibration data for analysis.")
-
-# Display historical trends if data is available
-if HISTORICAL_DATA:
-    st.subheader("Historical Trends")
-    timestamps = [entry["Timestamp"] for entry in HISTORICAL_DATA]
-    rms_values = [entry["RMS Value"] for entry in HISTORICAL_DATA]
-    dominant_frequencies = [entry["Dominant Frequency"] for entry in HISTORICAL_DATA]
-
-    fig, ax = plt.subplots(2, 1, figsize=(10, 8))
-    ax[0].plot(timestamps, rms_values, marker="o", label="RMS Value")
-    ax[0].set_title("Historical RMS Trend")
-    ax[0].set_ylabel("RMS Value")
-    ax[0].grid()
-    ax[0].legend()
-
-    ax[1].plot(timestamps, dominant_frequencies, marker="o", label="Dominant Frequency (Hz)", color="orange")
-    ax[1].set_title("Historical Dominant Frequency Trend")
-    ax[1].set_ylabel("Frequency (Hz)")
-    ax[1].grid()
-    ax[1].legend()
-
-    st.pyplot(fig)
+# For split deployments the analyzer runs headless (BAMLAK_HEADLESS=1,
+# via plain `python Main.py`) and a separate `streamlit run Main.py`
+# with BAMLAK_DASHBOARD_ONLY=1 reads the shared-memory ring — Streamlit
+# reruns then never contend with the analysis loop. Without either
+# variable set, the single-process mode below behaves as before.
+if os.environ.get("BAMLAK_HEADLESS"):
+    start_websocket_server()
+else:
+    st.title("Induction Motor Vibration Analysis")
+    st.sidebar.header("Configuration")
+
+    # Start the WebSocket event loop in a separate thread if not
+    # already running; the batch flusher runs as a task on that loop.
+    if ("websocket_thread" not in st.session_state
+            and not os.environ.get("BAMLAK_DASHBOARD_ONLY")):
+        st.session_state.websocket_thread = threading.Thread(target=start_websocket_server, daemon=True)
+        st.session_state.websocket_thread.start()
+
+    st.info("Connect to the WebSocket server at ws://<this host>:8765 to send vibration data for analysis.")
+
+    # Display historical trends if data is available
+    if int(_hist_count[0]):
+        st.subheader("Historical Trends")
+        timestamps, rms_values, dominant_frequencies = get_historical_data()
+
+        trends = pd.DataFrame(
+            {"RMS Value": rms_values, "Dominant Frequency (Hz)": dominant_frequencies},
+            index=timestamps,
+        )
+        st.caption("Historical RMS Trend")
+        st.line_chart(trends[["RMS Value"]])
+        st.caption("Historical Dominant Frequency Trend")
+        st.line_chart(trends[["Dominant Frequency (Hz)"]])